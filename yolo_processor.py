@@ -1,13 +1,16 @@
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 from supabase import create_client, Client
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import time
-from PIL import Image
-import io
+import shutil
+from concurrent.futures import ThreadPoolExecutor, wait
 import cv2
 import numpy as np
+import torch
 from ultralytics import YOLO
 
 # Supabase configuration
@@ -16,72 +19,219 @@ SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_KEY")  # Use service key for wri
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 MODEL_PATH = 'best.pt'
+ENGINE_PATH = 'best.engine'  # TensorRT FP16 engine, di-export dari MODEL_PATH
+INT8_MODEL_PATH = 'best-int8.pt'  # Salinan sementara MODEL_PATH, supaya export INT8 punya nama file sendiri
+INT8_ENGINE_PATH = 'best-int8.engine'  # TensorRT INT8 engine, dipakai jika data kalibrasi tersedia
+CALIB_DATA = os.environ.get("YOLO_CALIB_DATA")  # Dataset yaml berisi frame representatif untuk kalibrasi INT8
+# Ukuran input = imgsz saat training best.pt (args di checkpoint), dipakai juga untuk
+# export TensorRT supaya engine cukup satu optimization profile
+IMG_SIZE = 320
+BATCH_SIZE = 16  # Jumlah gambar per forward pass YOLO
+CONF_THRESHOLD = 0.25  # Confidence minimum deteksi (default Ultralytics)
+IOU_THRESHOLD = 0.7  # IoU threshold NMS (default Ultralytics)
+DOWNLOAD_WORKERS = 8  # Jumlah thread untuk download paralel
+UPLOAD_WORKERS = 4  # Jumlah thread untuk upload + update status paralel
+DOWNLOAD_TIMEOUT = 10  # Timeout download gambar (detik)
+
+def read_poll_interval():
+    """Read POLL_INTERVAL (seconds) from the environment, exit with a clear message if invalid"""
+    value = os.environ.get("POLL_INTERVAL", "0")
+    try:
+        return int(value)
+    except ValueError:
+        raise SystemExit(f"Invalid POLL_INTERVAL {value!r}: must be a whole number of seconds")
+
+# Interval polling dalam detik, 0 = jalan sekali lalu keluar (mode cron GitHub Actions).
+# Dibaca sebelum load model supaya nilai salah langsung gagal tanpa menunggu export engine
+POLL_INTERVAL = read_poll_interval()
+
+def use_int8():
+    """
+    Cek apakah engine INT8 bisa dipakai
+    Butuh data kalibrasi dan GPU dengan tensor core (compute capability >= 7.0)
+    """
+    if not CALIB_DATA or not os.path.exists(CALIB_DATA):
+        return False
+    return torch.cuda.get_device_capability() >= (7, 0)
+
+def export_engine(int8=False):
+    """Export MODEL_PATH to a TensorRT engine and return the engine path"""
+    if int8:
+        print(f"Exporting {MODEL_PATH} to TensorRT INT8 engine (calibration: {CALIB_DATA})...")
+        # Ultralytics menamai engine sesuai nama checkpoint, export dari salinan
+        # best-int8.pt supaya hasilnya best-int8.engine dan best.engine (FP16) tidak tertimpa
+        shutil.copyfile(MODEL_PATH, INT8_MODEL_PATH)
+        try:
+            return YOLO(INT8_MODEL_PATH).export(
+                format='engine', imgsz=IMG_SIZE, int8=True, data=CALIB_DATA,
+                dynamic=True, batch=BATCH_SIZE, workspace=4
+            )
+        finally:
+            os.remove(INT8_MODEL_PATH)
+    
+    print(f"Exporting {MODEL_PATH} to TensorRT FP16 engine...")
+    return YOLO(MODEL_PATH).export(
+        format='engine', imgsz=IMG_SIZE, half=True,
+        dynamic=True, batch=BATCH_SIZE, workspace=4
+    )
+
+def tensorrt_available():
+    """Cek apakah package tensorrt terpasang dan bisa di-import"""
+    try:
+        import tensorrt  # noqa: F401
+        return True
+    except Exception:
+        return False
+
+def warmup_model(yolo_model):
+    """Run a dummy inference so the first real batch does not pay the warmup cost"""
+    with torch.inference_mode():
+        yolo_model(np.zeros((IMG_SIZE, IMG_SIZE, 3), dtype=np.uint8), imgsz=IMG_SIZE, half=True, verbose=False)
+
+def load_engine(engine_path, int8=False):
+    """Load (and export if missing) a TensorRT engine, raises if the engine cannot be used"""
+    if not os.path.exists(engine_path):
+        # Export sekali saja, engine dipakai ulang di run berikutnya
+        engine_path = export_engine(int8)
+    engine_model = YOLO(engine_path, task='detect')
+    # YOLO() untuk engine bersifat lazy, paksa TensorRT deserialize di sini
+    warmup_model(engine_model)
+    return engine_model
+
+def load_model():
+    """
+    Load TensorRT engine if a GPU is available, otherwise the PyTorch model
+    Returns (model, class names)
+    """
+    if torch.cuda.is_available() and not tensorrt_available():
+        # Tanpa TensorRT jangan sentuh engine cache dan jangan export (bisa memicu pip install)
+        print(f"TensorRT not available, using {MODEL_PATH}")
+    elif torch.cuda.is_available():
+        # Coba INT8 dulu (jika ada data kalibrasi), lalu FP16, baru fallback ke .pt
+        engines = [(ENGINE_PATH, False)]
+        if use_int8():
+            engines.insert(0, (INT8_ENGINE_PATH, True))
+        
+        for engine_path, int8 in engines:
+            try:
+                cached = os.path.exists(engine_path)
+                try:
+                    engine_model = load_engine(engine_path, int8)
+                except Exception as e:
+                    if not cached:
+                        raise
+                    # TensorRT ada tapi engine gagal di-deserialize: engine stale
+                    # (versi TensorRT, driver, atau GPU berubah), hapus dan export ulang
+                    print(f"Error loading cached engine {engine_path}, re-exporting: {e}")
+                    os.remove(engine_path)
+                    engine_model = load_engine(engine_path, int8)
+                # Ambil names dari backend yang sudah di-load warmup, bukan model.names
+                # (untuk engine itu membuat predictor baru dan deserialize ulang)
+                return engine_model, engine_model.predictor.model.names
+            except Exception as e:
+                print(f"Error loading TensorRT engine {engine_path}: {e}")
+        
+        print(f"Falling back to {MODEL_PATH}")
+    pt_model = YOLO(MODEL_PATH)
+    return pt_model, pt_model.names
+
 # Load YOLO model
-model = YOLO(MODEL_PATH)  # Model standar
+model, class_names = load_model()
+# Mapping nama class -> id, supaya filter cukup bandingkan integer
+TARGET_IDS = {name: idx for idx, name in class_names.items()}
 
 # Konfigurasi retry
 MAX_RETRY_COUNT = 3  # Maksimal percobaan ulang untuk failed images
 RETRY_DELAY_HOURS = 1  # Delay sebelum retry (dalam jam)
 
+# HTTP session dipakai ulang supaya koneksi keep-alive (tanpa TLS handshake per gambar)
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,  # Cukup untuk semua thread download_pool
+    max_retries=Retry(total=3, backoff_factor=0.3)
+))
+download_pool = ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS)
+upload_pool = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS)
+
 def download_image(image_url):
-    """Download image from URL"""
+    """Download image from URL, returns (BGR image, original bytes if the source is a JPEG)"""
     try:
-        response = requests.get(image_url)
+        response = http_session.get(image_url, timeout=DOWNLOAD_TIMEOUT)
         response.raise_for_status()
-        return Image.open(io.BytesIO(response.content))
+        
+        # Decode langsung ke array BGR dengan OpenCV, format yang dipakai Ultralytics
+        image = cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise Exception("Failed to decode image")
+        
+        # Simpan bytes asli JPEG supaya bisa di-upload ulang tanpa re-encode
+        is_jpeg = response.headers.get('Content-Type', '').startswith('image/jpeg')
+        return image, response.content if is_jpeg else None
     except Exception as e:
         print(f"Error downloading image: {e}")
-        return None
+        return None, None
 
-def process_image_with_yolo(image, target_class='person'):
-    """Process image with YOLO and return annotated image and detection results"""
+def process_images_with_yolo(images, target_class='person'):
+    """Process a batch of images with YOLO and return (annotated image, detections) per image"""
     try:
-        # Convert PIL Image to OpenCV format
-        opencv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        
-        # Run YOLO inference
-        results = model(opencv_image)
+        target_id = TARGET_IDS.get(target_class, -1)
         
-        # Annotate image with detections
-        annotated_image = results[0].plot()
+        # Batasi NMS hanya ke class target supaya class lain tidak ikut diproses
+        classes = None if target_class == 'all' else [target_id]
         
-        # Convert back to PIL Image
-        annotated_pil = Image.fromarray(cv2.cvtColor(annotated_image, cv2.COLOR_BGR2RGB))
+        # Array BGR langsung ke YOLO, sesuai format input Ultralytics.
+        # Sengaja tidak di-resize manual ke tensor IMG_SIZE: letterbox Ultralytics menjaga
+        # aspect ratio dan mengembalikan box dalam koordinat gambar asli.
+        with torch.inference_mode():
+            results = model(images, imgsz=IMG_SIZE, half=True, classes=classes,
+                            conf=CONF_THRESHOLD, iou=IOU_THRESHOLD, verbose=False)
         
-        # Extract detection information - filter only target class
-        detections = []
+        outputs = []
         for result in results:
-            boxes = result.boxes
-            for box in boxes:
-                class_id = int(box.cls)
-                class_name = model.names[class_id]
-                
-                # Filter hanya class yang diinginkan (default: person)
-                if target_class == 'all' or class_name == target_class:
-                    detection = {
-                        'class': class_name,
-                        'confidence': float(box.conf),
-                        'bbox': box.xyxy[0].tolist()
-                    }
-                    detections.append(detection)
-        
-        return annotated_pil, detections
+            # Boxes sudah difilter ke target class oleh classes=, jadi plot()
+            # menggambar semua box dalam satu panggilan, sama persis dengan detections.
+            # Tanpa deteksi tidak ada yang digambar, pakai gambar asli saja.
+            annotated_image = result.plot() if len(result.boxes) else result.orig_img
+            
+            # Extract detection information - satu transfer per tensor, bukan per box
+            cls = result.boxes.cls.cpu().numpy().astype(np.int32)
+            conf = result.boxes.conf.cpu().numpy()
+            xyxy = result.boxes.xyxy.cpu().numpy()
+            
+            detections = [
+                {
+                    'class': class_names[class_id],
+                    'confidence': float(score),
+                    'bbox': bbox.tolist()
+                }
+                for class_id, score, bbox in zip(cls, conf, xyxy)
+            ]
+            
+            outputs.append((annotated_image, detections))
+        
+        return outputs
     except Exception as e:
-        print(f"Error processing image with YOLO: {e}")
-        return None, []
+        print(f"Error processing images with YOLO: {e}")
+        return [(None, [])] * len(images)
 
 def upload_processed_image(image, filename):
     """Upload processed image to Supabase storage"""
     try:
-        # Convert PIL Image to bytes
-        img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format='JPEG', quality=85)
-        img_byte_arr.seek(0)
+        if isinstance(image, bytes):
+            # Sudah berupa JPEG, upload apa adanya
+            image_bytes = image
+        else:
+            # Encode BGR array dengan OpenCV (libjpeg-turbo, SIMD)
+            ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            if not ok:
+                raise Exception("Failed to encode image")
+            image_bytes = buffer.tobytes()
         
         # Upload to processed-images bucket
         uploaded_file = supabase.storage.from_("processed-images").upload(
             f"processed_{filename}", 
-            img_byte_arr.getvalue(),
+            image_bytes,
             {"content-type": "image/jpeg"}
         )
         
@@ -94,13 +244,15 @@ def upload_processed_image(image, filename):
 
 def update_processing_status(record_id, status, processed_image_url=None, 
                            processing_result=None, error_message=None, 
-                           processing_time=None, retry_count=None, last_error=None):
+                           processing_time=None, retry_count=None, last_error=None, now=None):
     """Update processing status in database"""
     try:
+        # Timestamp dihitung sekali, atau dipakai dari batch pemanggil
+        now = now or datetime.now(timezone.utc).isoformat()
         update_data = {
             "status": status,
             "processed": status == "completed",
-            "updated_at": datetime.now().isoformat()
+            "updated_at": now
         }
         
         if processed_image_url:
@@ -122,7 +274,7 @@ def update_processing_status(record_id, status, processed_image_url=None,
             update_data["last_error"] = last_error
             
         if status == "completed":
-            update_data["processed_at"] = datetime.now().isoformat()
+            update_data["processed_at"] = now
             # Reset retry count jika berhasil
             update_data["retry_count"] = 0
             update_data["last_error"] = None
@@ -137,7 +289,43 @@ def update_processing_status(record_id, status, processed_image_url=None,
         print(f"Error updating processing status: {e}")
         return False
 
-def should_retry_failed_image(record):
+def mark_processing(record_ids, now=None):
+    """Update status of multiple records to processing in a single query"""
+    try:
+        update_data = {
+            "status": "processing",
+            "processed": False,
+            "updated_at": now or datetime.now(timezone.utc).isoformat()
+        }
+        
+        response = supabase.table("yolo_processing").update(update_data).in_("id", record_ids).execute()
+        
+        if hasattr(response, 'error') and response.error:
+            print(f"Error updating status: {response.error}")
+            return False
+        return True
+    except Exception as e:
+        print(f"Error updating processing status: {e}")
+        return False
+
+def is_before(timestamp, cutoff_iso):
+    """
+    Cek apakah timestamp ISO-8601 lebih lama dari cutoff (ISO-8601 UTC)
+    Timestamp UTC dibandingkan langsung sebagai string, format lain di-parse
+    """
+    if timestamp[10:11] == 'T' and timestamp.endswith(('+00:00', 'Z')):
+        return timestamp < cutoff_iso
+    
+    timestamp_dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    if timestamp_dt.tzinfo is None:
+        timestamp_dt = timestamp_dt.replace(tzinfo=timezone.utc)
+    return timestamp_dt < datetime.fromisoformat(cutoff_iso)
+
+def retry_cutoff():
+    """Return ISO-8601 UTC cutoff, failures updated before it may be retried"""
+    return (datetime.now(timezone.utc) - timedelta(hours=RETRY_DELAY_HOURS)).isoformat()
+
+def should_retry_failed_image(record, cutoff_iso=None):
     """
     Cek apakah failed image harus di-retry
     Berdasarkan retry_count dan waktu terakhir error
@@ -156,11 +344,8 @@ def should_retry_failed_image(record):
     
     # Cek apakah sudah cukup waktu sejak error terakhir
     try:
-        last_error_dt = datetime.fromisoformat(last_error_time.replace('Z', '+00:00'))
-        time_since_error = datetime.now() - last_error_dt
-        
         # Jika error terjadi kurang dari RETRY_DELAY_HOURS yang lalu, tunggu dulu
-        if time_since_error < timedelta(hours=RETRY_DELAY_HOURS):
+        if not is_before(last_error_time, cutoff_iso or retry_cutoff()):
             print(f"  Skipping {record['filename']} - retry delay not reached")
             return False
     except Exception as e:
@@ -170,31 +355,33 @@ def should_retry_failed_image(record):
     
     return True
 
-def process_single_image(record, process_failed=False):
-    """Process single image record"""
-    record_id = record['id']
-    filename = record['filename']
-    original_url = record['original_image_url']
-    current_status = record['status']
+def mark_failed(record, error_msg, processing_time, now=None):
+    """Mark record as failed and increment its retry count"""
+    print(f"✗ Error processing {record['filename']}: {error_msg}")
     
-    print(f"Processing {filename} (status: {current_status})")
-    
-    # Update status to processing
-    update_processing_status(record_id, "processing")
-    
-    start_time = time.time()
+    # Increment retry count
+    current_retry_count = record.get('retry_count', 0)
+    new_retry_count = current_retry_count + 1
     
+    # Update status to failed dengan retry count baru
+    update_processing_status(
+        record['id'], 
+        "failed", 
+        error_message=error_msg,
+        processing_time=processing_time,
+        retry_count=new_retry_count,
+        last_error=error_msg,
+        now=now
+    )
+
+def start_downloads(records):
+    """Submit downloads for records to the download pool"""
+    return [download_pool.submit(download_image, record['original_image_url']) for record in records]
+
+def finish_record(record, processed_image, detections, start_time):
+    """Upload processed image and mark record as completed, returns True on success"""
+    filename = record['filename']
     try:
-        # Download original image
-        original_image = download_image(original_url)
-        if not original_image:
-            raise Exception("Failed to download image")
-        
-        # Process with YOLO
-        processed_image, detections = process_image_with_yolo(original_image, target_class='person')
-        if not processed_image:
-            raise Exception("YOLO processing failed")
-        
         # Upload processed image
         processed_url = upload_processed_image(processed_image, filename)
         if not processed_url:
@@ -204,7 +391,7 @@ def process_single_image(record, process_failed=False):
         
         # Update record with results
         success = update_processing_status(
-            record_id, 
+            record['id'], 
             "completed", 
             processed_url, 
             detections,
@@ -220,79 +407,119 @@ def process_single_image(record, process_failed=False):
             return False
             
     except Exception as e:
-        processing_time = time.time() - start_time
-        error_msg = str(e)
-        print(f"✗ Error processing {filename}: {error_msg}")
-        
-        # Increment retry count
-        current_retry_count = record.get('retry_count', 0)
-        new_retry_count = current_retry_count + 1
-        
-        # Update status to failed dengan retry count baru
-        update_processing_status(
-            record_id, 
-            "failed", 
-            error_message=error_msg,
-            processing_time=processing_time,
-            retry_count=new_retry_count,
-            last_error=error_msg
-        )
+        mark_failed(record, str(e), time.time() - start_time)
         return False
 
-def process_pending_images():
-    """Process all pending images in the database"""
-    try:
-        # Fetch pending records
-        response = supabase.table("yolo_processing").select("*").eq("status", "pending").execute()
+def process_image_batch(records, downloads, uploads, process_failed=False):
+    """Process a batch of image records, uploads are submitted to upload_pool and tracked in uploads"""
+    start_time = time.time()
+    batch_now = datetime.now(timezone.utc).isoformat()
+    
+    # Update status to processing untuk seluruh batch sekaligus
+    mark_processing([record['id'] for record in records], now=batch_now)
+    
+    # Fase 1: kumpulkan hasil download (sudah berjalan di download_pool)
+    batch = []
+    for record, download in zip(records, downloads):
+        print(f"Processing {record['filename']} (status: {record['status']})")
+        
+        original_image, original_jpeg = download.result()
+        if original_image is None:
+            mark_failed(record, "Failed to download image", time.time() - start_time, now=batch_now)
+            continue
+        batch.append((record, original_image, original_jpeg))
+    
+    if not batch:
+        return
+    
+    # Fase 2: YOLO inference untuk seluruh batch sekaligus
+    outputs = process_images_with_yolo([image for _, image, _ in batch], target_class='person')
+    
+    # Fase 3: upload dan update hasil di background, overlap dengan batch berikutnya
+    for (record, _, original_jpeg), (processed_image, detections) in zip(batch, outputs):
+        if processed_image is None:
+            mark_failed(record, "YOLO processing failed", time.time() - start_time, now=batch_now)
+            continue
+        
+        # Tanpa deteksi, gambar hasil sama dengan aslinya: upload JPEG asli tanpa re-encode
+        if not detections and original_jpeg is not None:
+            processed_image = original_jpeg
+        
+        uploads[record['id']] = upload_pool.submit(
+            finish_record, record, processed_image, detections, start_time
+        )
+
+def process_records(records, process_failed=False):
+    """Process records in batches of BATCH_SIZE, returns number of successful records"""
+    batches = [records[i:i + BATCH_SIZE] for i in range(0, len(records), BATCH_SIZE)]
+    next_downloads = start_downloads(batches[0]) if batches else []
+    uploads = {}
+    
+    for i, batch_records in enumerate(batches):
+        downloads = next_downloads
         
-        if hasattr(response, 'error') and response.error:
-            print(f"Error fetching pending images: {response.error}")
-            return
+        # Prefetch batch berikutnya selagi batch ini diproses YOLO
+        if i + 1 < len(batches):
+            next_downloads = start_downloads(batches[i + 1])
         
-        pending_records = response.data
+        process_image_batch(batch_records, downloads, uploads, process_failed=process_failed)
+    
+    # Tunggu semua upload yang masih berjalan
+    wait(uploads.values())
+    return sum(1 for upload in uploads.values() if upload.result())
+
+def process_pending_images(pending_records=None):
+    """Process all pending images in the database, or the given pending records"""
+    try:
+        if pending_records is None:
+            # Fetch pending records
+            response = supabase.table("yolo_processing").select("*").eq("status", "pending").execute()
+            
+            if hasattr(response, 'error') and response.error:
+                print(f"Error fetching pending images: {response.error}")
+                return
+            
+            pending_records = response.data
         print(f"Found {len(pending_records)} pending images")
         
-        success_count = 0
-        for record in pending_records:
-            if process_single_image(record):
-                success_count += 1
+        success_count = process_records(pending_records)
         
         print(f"✓ Processed {success_count}/{len(pending_records)} pending images successfully")
         
     except Exception as e:
         print(f"Error in process_pending_images: {e}")
 
-def retry_failed_images():
+def retry_failed_images(failed_records=None):
     """Retry processing failed images based on retry logic"""
     try:
-        # Fetch failed records
-        response = supabase.table("yolo_processing").select("*").eq("status", "failed").execute()
-        
-        if hasattr(response, 'error') and response.error:
-            print(f"Error fetching failed images: {response.error}")
-            return
-        
-        failed_records = response.data
+        if failed_records is None:
+            # Fetch failed records
+            response = supabase.table("yolo_processing").select("*").eq("status", "failed").execute()
+            
+            if hasattr(response, 'error') and response.error:
+                print(f"Error fetching failed images: {response.error}")
+                return
+            
+            failed_records = response.data
         print(f"Found {len(failed_records)} failed images")
         
-        # Filter yang perlu di-retry
+        # Filter yang perlu di-retry, cutoff dihitung sekali untuk semua record
+        cutoff_iso = retry_cutoff()
         records_to_retry = []
         for record in failed_records:
-            if should_retry_failed_image(record):
+            if should_retry_failed_image(record, cutoff_iso):
                 records_to_retry.append(record)
             else:
                 print(f"  Not retrying {record['filename']} - retry logic conditions not met")
         
         print(f"Will retry {len(records_to_retry)} failed images")
         
-        success_count = 0
         for record in records_to_retry:
             print(f"\nRetrying failed image: {record['filename']}")
             print(f"  Previous error: {record.get('error_message', 'Unknown error')}")
             print(f"  Retry count: {record.get('retry_count', 0)}/{MAX_RETRY_COUNT}")
-            
-            if process_single_image(record, process_failed=True):
-                success_count += 1
+        
+        success_count = process_records(records_to_retry, process_failed=True)
         
         print(f"\n✓ Retried {success_count}/{len(records_to_retry)} failed images successfully")
         
@@ -301,61 +528,62 @@ def retry_failed_images():
 
 def process_all_images():
     """Process both pending and failed images"""
+    # Ambil pending dan failed dalam satu query, lalu pisahkan di sini
+    try:
+        response = supabase.table("yolo_processing").select("*").in_("status", ["pending", "failed"]).execute()
+        
+        if hasattr(response, 'error') and response.error:
+            print(f"Error fetching images: {response.error}")
+            return
+    except Exception as e:
+        print(f"Error in process_all_images: {e}")
+        return
+    
+    pending_records = [r for r in response.data if r['status'] == 'pending']
+    failed_records = [r for r in response.data if r['status'] == 'failed']
+    
     print("\n" + "="*50)
     print("Processing PENDING images...")
     print("="*50)
-    process_pending_images()
+    process_pending_images(pending_records)
     
     print("\n" + "="*50)
     print("Processing FAILED images (with retry logic)...")
     print("="*50)
-    retry_failed_images()
+    retry_failed_images(failed_records)
 
 def cleanup_old_failures():
     """Cleanup very old failed records that exceeded max retry"""
     try:
         # Hapus records yang sudah melewati maksimal retry dan error sudah lama
-        cutoff_time = datetime.now() - timedelta(days=7)  # 7 hari yang lalu
+        cutoff_time = datetime.now(timezone.utc) - timedelta(days=7)  # 7 hari yang lalu
         cutoff_time_str = cutoff_time.isoformat()
         
-        response = supabase.table("yolo_processing").select("*").eq("status", "failed").execute()
+        # Filter dijalankan di database, cukup satu query DELETE.
+        # updated_at selalu ditulis dalam UTC, jadi sebanding dengan cutoff UTC ini
+        response = (
+            supabase.table("yolo_processing")
+            .delete()
+            .eq("status", "failed")
+            .gte("retry_count", MAX_RETRY_COUNT)
+            .lt("updated_at", cutoff_time_str)
+            .execute()
+        )
         
         if hasattr(response, 'error') and response.error:
-            print(f"Error fetching records for cleanup: {response.error}")
+            print(f"Error cleaning up old failures: {response.error}")
             return
         
-        records = response.data
-        cleaned_count = 0
+        for record in response.data:
+            print(f"  Cleaned up old failed record: {record['filename']}")
         
-        for record in records:
-            retry_count = record.get('retry_count', 0)
-            updated_at = record.get('updated_at')
-            
-            # Jika sudah melewati maksimal retry DAN error sudah lebih dari 7 hari
-            if retry_count >= MAX_RETRY_COUNT and updated_at:
-                try:
-                    updated_dt = datetime.fromisoformat(updated_at.replace('Z', '+00:00'))
-                    if updated_dt < cutoff_time:
-                        # Delete record (atau update status menjadi 'abandoned')
-                        supabase.table("yolo_processing").delete().eq("id", record['id']).execute()
-                        print(f"  Cleaned up old failed record: {record['filename']}")
-                        cleaned_count += 1
-                except Exception as e:
-                    print(f"  Error parsing date for cleanup: {e}")
-        
-        print(f"✓ Cleaned up {cleaned_count} old failed records")
+        print(f"✓ Cleaned up {len(response.data)} old failed records")
         
     except Exception as e:
         print(f"Error in cleanup_old_failures: {e}")
 
-if __name__ == "__main__":
-    print("="*50)
-    print("YOLO Image Processor with Retry Logic")
-    print("="*50)
-    print(f"Max retry count: {MAX_RETRY_COUNT}")
-    print(f"Retry delay: {RETRY_DELAY_HOURS} hours")
-    print("="*50)
-    
+def run_once():
+    """Process pending + failed images and cleanup old failures"""
     # Pilihan: bisa dipilih salah satu atau semua
     process_all_images()  # Proses semua (pending + failed dengan retry)
     
@@ -368,3 +596,23 @@ if __name__ == "__main__":
     print("\n" + "="*50)
     print("Processing completed!")
     print("="*50)
+
+if __name__ == "__main__":
+    print("="*50)
+    print("YOLO Image Processor with Retry Logic")
+    print("="*50)
+    print(f"Max retry count: {MAX_RETRY_COUNT}")
+    print(f"Retry delay: {RETRY_DELAY_HOURS} hours")
+    print(f"Poll interval: {POLL_INTERVAL} seconds" if POLL_INTERVAL > 0 else "Poll interval: disabled (single run)")
+    print("="*50)
+    
+    if POLL_INTERVAL > 0:
+        # Mode resident: model tetap di memori, tidak perlu load ulang tiap run.
+        # Engine TensorRT sudah di-warmup di load_engine, cukup warmup jika belum pernah predict
+        if model.predictor is None:
+            warmup_model(model)
+        while True:
+            run_once()
+            time.sleep(POLL_INTERVAL)
+    else:
+        run_once()